@@ -1,11 +1,13 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import folium
-from folium.plugins import MarkerCluster
+from folium.plugins import FastMarkerCluster
 from streamlit_folium import st_folium
-from geopy.distance import geodesic
 from io import BytesIO
 
+from utils import build_workshop_tree, greedy_spatial_clustering, nearest_workshop_km
+
 # ---------------------------
 # PAGE CONFIG
 # ---------------------------
@@ -17,6 +19,146 @@ This tool visualizes existing Mahindra workshops and identifies potential new wo
 based on **F30 RO projections** and **distance constraints**.
 """)
 
+# ---------------------------
+# CACHED HELPERS
+# ---------------------------
+def make_finder(df):
+    # One pass over the columns builds a lowercase map; each candidate
+    # lookup is then an O(1) dict hit instead of a nested loop scan.
+    low = {c.lower(): c for c in df.columns if isinstance(c, str)}
+    return lambda cands: next((low[c.lower()] for c in cands if c.lower() in low), None)
+
+@st.cache_data(show_spinner=False)
+def load_excel(bytes_or_url):
+    # Cache keyed on file bytes (uploads) or URL string (GitHub files),
+    # so slider/checkbox reruns skip the parse entirely. Prefer the Rust
+    # calamine engine (5-20x faster on .xlsx than openpyxl); fall back to
+    # the pandas default if python-calamine is missing.
+    def _read(engine):
+        src = BytesIO(bytes_or_url) if isinstance(bytes_or_url, bytes) else bytes_or_url
+        if engine:
+            return pd.read_excel(src, engine=engine)
+        return pd.read_excel(src)
+
+    try:
+        return _read("calamine")
+    except (ImportError, ValueError):
+        return _read(None)
+
+@st.cache_data(show_spinner=False)
+def cluster_projections(df_proj, max_ro):
+    # Spatially coherent greedy clustering from utils (seed on highest RO,
+    # grow by nearest pincode). The old sort-by-RO sequential grouping mixed
+    # distant pincodes into one cluster, which made the distance filter on
+    # the centroid meaningless. Recomputed only when the projections data
+    # or max_ro changes.
+    renamed = df_proj.rename(columns={
+        "Proj_Pincode": "pincode",
+        "Proj_Lat": "lat",
+        "Proj_Lon": "lon",
+        "Proj_RO": "projected_ro"
+    })
+    labels, c_lats, c_lons, totals = greedy_spatial_clustering(renamed, max_ro)
+    cluster_names = np.array([f"Cluster_{i + 1}" for i in range(len(totals))])
+    df_clusters = df_proj.reset_index(drop=True).assign(Cluster_ID=cluster_names[labels])
+    centroids = pd.DataFrame({
+        "Cluster_ID": cluster_names,
+        "Proj_Lat": c_lats.astype(np.float64),
+        "Proj_Lon": c_lons.astype(np.float64),
+        "Proj_RO": totals.astype(np.float64)
+    })
+    return df_clusters, centroids
+
+@st.cache_data(show_spinner=False)
+def build_export(df_suggested, centroids):
+    # Serialize the download payload once per distinct result; re-clicking
+    # the button or toggling unrelated widgets reuses the cached bytes.
+    buffer = BytesIO()
+    try:
+        writer = pd.ExcelWriter(buffer, engine="xlsxwriter")
+    except ImportError:
+        writer = pd.ExcelWriter(buffer, engine="openpyxl")
+    with writer:
+        df_suggested.to_excel(writer, index=False, sheet_name="Suggested_Locations")
+        centroids.to_excel(writer, index=False, sheet_name="Cluster_Summary")
+    return buffer.getvalue()
+
+@st.cache_resource(show_spinner=False)
+def build_map(df_workshops, df_clusters, df_suggested):
+    # All three layers are always rendered as FeatureGroups with a
+    # LayerControl, so toggling them happens client-side in Leaflet and
+    # never triggers a server-side map rebuild. Cached on the frames, so
+    # only data/slider changes re-render the HTML.
+    map_center = [df_clusters["Proj_Lat"].mean(), df_clusters["Proj_Lon"].mean()]
+    m = folium.Map(location=map_center, zoom_start=7)
+
+    # One GeoJson layer per marker set: a single FeatureCollection renders
+    # as one Leaflet layer instead of one Python Marker + Jinja template
+    # render per row, and the HTML payload shrinks accordingly.
+    fg_workshops = folium.FeatureGroup(name="Existing Workshops", show=True)
+    ws_features = []
+    ws_cols = df_workshops[["Workshop_Lat", "Workshop_Lon", "Workshop", "Workshop_Pincode"]]
+    for lat, lon, name, pincode in ws_cols.itertuples(index=False, name=None):
+        ws_features.append({
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [float(lon), float(lat)]},
+            "properties": {"name": str(name), "pincode": str(pincode)}
+        })
+    # only attach the layer when there are features: GeoJsonTooltip's field
+    # check fails on an empty FeatureCollection
+    if ws_features:
+        folium.GeoJson(
+            {"type": "FeatureCollection", "features": ws_features},
+            marker=folium.CircleMarker(radius=5, color="red", fill=True, fill_opacity=0.9),
+            tooltip=folium.GeoJsonTooltip(fields=["name", "pincode"], aliases=["Workshop", "Pincode"])
+        ).add_to(fg_workshops)
+    fg_workshops.add_to(m)
+
+    fg_clusters = folium.FeatureGroup(name="Clusters", show=True)
+    cluster_callback = """
+    function (row) {
+        var marker = L.circleMarker(new L.LatLng(row[0], row[1]),
+            {radius: 4, color: "blue", fill: true, fillOpacity: 0.6});
+        marker.bindPopup("Cluster: " + row[2] + "<br>ROs: " + row[3]);
+        return marker;
+    }
+    """
+    FastMarkerCluster(
+        df_clusters[["Proj_Lat", "Proj_Lon", "Cluster_ID", "Proj_RO"]].values.tolist(),
+        callback=cluster_callback
+    ).add_to(fg_clusters)
+    fg_clusters.add_to(m)
+
+    fg_suggested = folium.FeatureGroup(name="Suggested Locations", show=True)
+    sugg_features = []
+    sugg_cols = df_suggested[["Proj_Lat", "Proj_Lon", "Cluster_ID", "Proj_RO"]]
+    for lat, lon, cluster_id, ro in sugg_cols.itertuples(index=False, name=None):
+        sugg_features.append({
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [float(lon), float(lat)]},
+            "properties": {"cluster": str(cluster_id), "ros": int(ro)}
+        })
+    # empty df_suggested is a normal outcome (every centroid too close to
+    # an existing workshop); skip the layer rather than crash the tooltip
+    if sugg_features:
+        folium.GeoJson(
+            {"type": "FeatureCollection", "features": sugg_features},
+            marker=folium.CircleMarker(radius=7, color="green", fill=True, fill_opacity=0.9),
+            tooltip=folium.GeoJsonTooltip(fields=["cluster", "ros"], aliases=["Cluster", "ROs"])
+        ).add_to(fg_suggested)
+    fg_suggested.add_to(m)
+
+    folium.LayerControl(collapsed=False).add_to(m)
+    return m
+
+@st.cache_resource(show_spinner=False)
+def get_workshop_tree(df_workshops):
+    # Keyed on the workshops frame only, so changing min_distance_km
+    # never rebuilds the tree.
+    return build_workshop_tree(
+        df_workshops["Workshop_Lat"].to_numpy(), df_workshops["Workshop_Lon"].to_numpy()
+    )
+
 # ---------------------------
 # DATA SOURCE SELECTION
 # ---------------------------
@@ -47,15 +189,15 @@ try:
     if data_source == "Use GitHub Files (Default)":
         workshop_url = GITHUB_RAW_BASE + "KMA_Mahindra_Workshops_Lat_Long.xlsx"
         proj_url = GITHUB_RAW_BASE + "KMA_NRC_F30_Retail_RO_Projections_PV_Lat_Long_Pincode.xlsx"
-        df_workshops = pd.read_excel(workshop_url)
-        df_proj = pd.read_excel(proj_url)
+        df_workshops = load_excel(workshop_url)
+        df_proj = load_excel(proj_url)
         st.sidebar.success("✅ Loaded data from GitHub repository.")
     else:
         workshop_file = st.sidebar.file_uploader("Upload Workshop File", type=["xlsx"], key="workshop")
         projection_file = st.sidebar.file_uploader("Upload F30 Projection File", type=["xlsx"], key="projection")
         if workshop_file and projection_file:
-            df_workshops = pd.read_excel(workshop_file)
-            df_proj = pd.read_excel(projection_file)
+            df_workshops = load_excel(workshop_file.getvalue())
+            df_proj = load_excel(projection_file.getvalue())
             st.sidebar.success("✅ Files uploaded successfully.")
         else:
             st.info("⬆️ Please upload both Excel files to begin.")
@@ -71,101 +213,49 @@ try:
     df_workshops.columns = df_workshops.columns.str.strip()
     df_proj.columns = df_proj.columns.str.strip()
 
-    # Rename based on actual headers
+    # Rename based on actual headers (case-insensitive, tolerant of the
+    # misspelled "Mabindra" header shipped in the source file)
+    ws_find = make_finder(df_workshops)
     df_workshops = df_workshops.rename(columns={
-        "Mabindra Workshop Location": "Workshop",
-        "Pincode": "Workshop_Pincode",
-        "Latitude": "Workshop_Lat",
-        "Longitude": "Workshop_Lon"
+        ws_find(["Mabindra Workshop Location", "Mahindra Workshop Location", "Workshop"]): "Workshop",
+        ws_find(["Pincode"]): "Workshop_Pincode",
+        ws_find(["Latitude"]): "Workshop_Lat",
+        ws_find(["Longitude"]): "Workshop_Lon"
     })
 
+    proj_find = make_finder(df_proj)
     df_proj = df_proj.rename(columns={
-        "Customer Pin Code": "Proj_Pincode",
-        "Latitude": "Proj_Lat",
-        "Longitude": "Proj_Lon",
-        "F30_RO_Projection": "Proj_RO"
+        proj_find(["Customer Pin Code", "Pincode"]): "Proj_Pincode",
+        proj_find(["Latitude"]): "Proj_Lat",
+        proj_find(["Longitude"]): "Proj_Lon",
+        proj_find(["F30_RO_Projection", "Projected_RO"]): "Proj_RO"
     })
 
-    # Sort and cluster
-    df_proj = df_proj.sort_values("Proj_RO", ascending=False).reset_index(drop=True)
-    clusters = []
-    current_cluster = []
-    current_sum = 0
-    cluster_id = 1
-
-    for _, row in df_proj.iterrows():
-        if current_sum + row["Proj_RO"] <= max_ro or current_sum == 0:
-            current_cluster.append(row)
-            current_sum += row["Proj_RO"]
-        else:
-            clusters.append(pd.DataFrame(current_cluster).assign(Cluster_ID=f"Cluster_{cluster_id}"))
-            cluster_id += 1
-            current_cluster = [row]
-            current_sum = row["Proj_RO"]
-
-    if current_cluster:
-        clusters.append(pd.DataFrame(current_cluster).assign(Cluster_ID=f"Cluster_{cluster_id}"))
+    # Sort and cluster (cached on data + max_ro)
+    df_clusters, centroids = cluster_projections(df_proj, max_ro)
 
-    df_clusters = pd.concat(clusters, ignore_index=True)
-
-    # Cluster centroids
-    centroids = (
-        df_clusters.groupby("Cluster_ID")
-        .agg({"Proj_Lat": "mean", "Proj_Lon": "mean", "Proj_RO": "sum"})
-        .reset_index()
+    # Filter based on proximity: one BallTree query for all centroids at once
+    workshop_tree = get_workshop_tree(df_workshops)
+    nearest_km = nearest_workshop_km(
+        centroids["Proj_Lat"].to_numpy(), centroids["Proj_Lon"].to_numpy(), workshop_tree
+    )
+    df_suggested = (
+        centroids.assign(
+            # NaN rather than inf when there are no workshops, so the
+            # Excel writers accept the column
+            Nearest_Workshop_km=np.where(np.isfinite(nearest_km), np.round(nearest_km, 2), np.nan)
+        )
+        .loc[nearest_km >= min_distance_km]
+        .reset_index(drop=True)
     )
-
-    # Filter based on proximity
-    suggested_locations = []
-    for _, row in centroids.iterrows():
-        cluster_latlon = (row["Proj_Lat"], row["Proj_Lon"])
-        too_close = False
-        for _, ws in df_workshops.iterrows():
-            dist = geodesic(cluster_latlon, (ws["Workshop_Lat"], ws["Workshop_Lon"])).km
-            if dist < min_distance_km:
-                too_close = True
-                break
-        if not too_close:
-            suggested_locations.append(row)
-
-    df_suggested = pd.DataFrame(suggested_locations)
 
     # ---------------------------
     # MAP VISUALIZATION
     # ---------------------------
     st.subheader("🗺️ Interactive Map")
+    st.caption("Use the layer control on the map to toggle workshops, clusters and suggestions.")
 
-    map_center = [df_proj["Proj_Lat"].mean(), df_proj["Proj_Lon"].mean()]
-    m = folium.Map(location=map_center, zoom_start=7)
-
-    if st.sidebar.checkbox("Show Existing Workshops", value=True):
-        for _, row in df_workshops.iterrows():
-            folium.Marker(
-                [row["Workshop_Lat"], row["Workshop_Lon"]],
-                popup=f"🏭 {row['Workshop']}<br>Pincode: {row['Workshop_Pincode']}",
-                icon=folium.Icon(color="red", icon="wrench", prefix="fa")
-            ).add_to(m)
-
-    if st.sidebar.checkbox("Show Clusters", value=True):
-        marker_cluster = MarkerCluster().add_to(m)
-        for _, row in df_clusters.iterrows():
-            folium.CircleMarker(
-                [row["Proj_Lat"], row["Proj_Lon"]],
-                radius=4,
-                color="blue",
-                fill=True,
-                fill_opacity=0.6,
-                popup=f"Cluster: {row['Cluster_ID']}<br>ROs: {row['Proj_RO']}"
-            ).add_to(marker_cluster)
-
-    if not df_suggested.empty and st.sidebar.checkbox("Show Suggested Locations", value=True):
-        for _, row in df_suggested.iterrows():
-            folium.Marker(
-                [row["Proj_Lat"], row["Proj_Lon"]],
-                popup=f"🟢 Suggested Workshop<br>Cluster: {row['Cluster_ID']}<br>ROs: {int(row['Proj_RO'])}",
-                icon=folium.Icon(color="green", icon="plus", prefix="fa")
-            ).add_to(m)
-
+    m = build_map(df_workshops, df_clusters, df_suggested)
     st_folium(m, width=1200, height=700)
 
     # ---------------------------
@@ -174,14 +264,9 @@ try:
     st.subheader("📊 Cluster Summary")
     st.dataframe(centroids.rename(columns={"Proj_RO": "Total_ROs"}))
 
-    buffer = BytesIO()
-    with pd.ExcelWriter(buffer, engine="openpyxl") as writer:
-        df_suggested.to_excel(writer, index=False, sheet_name="Suggested_Locations")
-        centroids.to_excel(writer, index=False, sheet_name="Cluster_Summary")
-
     st.download_button(
         label="📥 Download Suggested Locations (Excel)",
-        data=buffer.getvalue(),
+        data=build_export(df_suggested, centroids),
         file_name="Suggested_Workshop_Locations.xlsx",
         mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
     )
@@ -1,6 +1,16 @@
 import pandas as pd
+import numpy as np
 import math
 from collections import deque
+from sklearn.neighbors import BallTree
+
+try:
+    from utils_numba import _cluster as _cluster_jit
+except ImportError:
+    # numba not installed; greedy_spatial_clustering falls back to NumPy
+    _cluster_jit = None
+
+EARTH_RADIUS_KM = 6371.0
 
 def haversine_km(lat1, lon1, lat2, lon2):
     # returns distance in kilometers between two points
@@ -13,6 +23,20 @@ def haversine_km(lat1, lon1, lat2, lon2):
     c = 2*math.atan2(math.sqrt(a), math.sqrt(1-a))
     return R * c
 
+def haversine_km_vec(lat0, lon0, lats, lons):
+    """
+    Vectorized haversine: distance in km from one point (lat0, lon0)
+    to arrays of points (lats, lons). One call computes all distances
+    with NumPy instead of one Python call per row.
+    """
+    R = 6371.0
+    phi0 = np.radians(lat0)
+    phis = np.radians(np.asarray(lats, dtype=np.float64))
+    dphi = phis - phi0
+    dlambda = np.radians(np.asarray(lons, dtype=np.float64) - lon0)
+    a = np.sin(dphi/2.0)**2 + np.cos(phi0)*np.cos(phis)*np.sin(dlambda/2.0)**2
+    return 2.0 * R * np.arcsin(np.sqrt(a))
+
 def greedy_spatial_clustering(df, max_ro=6000):
     """
     Greedy spatial clustering:
@@ -20,50 +44,121 @@ def greedy_spatial_clustering(df, max_ro=6000):
     - Start with highest projected_ro unassigned pincode as cluster seed
     - Keep adding nearest unassigned pincode to cluster until cluster_ro >= max_ro or no unassigned left
     - Continue until all pincodes assigned
-    - Returns list of clusters: each is dict with members (DataFrame), total_ro, centroid (lat,lon)
+    - Returns (labels, centroid_lats, centroid_lons, totals): labels is an
+      int32 array aligned to df's row order giving each row's cluster id;
+      the other three arrays hold one entry per cluster. Callers attach
+      labels with df.assign(cluster_id=labels) rather than receiving one
+      DataFrame copy per cluster.
     """
     working = df.copy().reset_index(drop=True)
     # ensure numeric
     working["projected_ro"] = pd.to_numeric(working["projected_ro"], errors="coerce").fillna(0)
-    unassigned = set(working.index.tolist())
-    clusters = []
 
-    # precompute coords
-    coords = working[["lat","lon"]].to_dict(orient="index")
+    # precompute coords as flat float32 arrays once; all inner-loop work is
+    # on these. float32 halves the memory traffic of the distance kernel and
+    # keeps ~1 m coordinate precision; the float64 Series in `working` stay
+    # untouched for display/export.
+    n = len(working)
+    lats = working["lat"].to_numpy(dtype=np.float32)
+    lons = working["lon"].to_numpy(dtype=np.float32)
+    ros = working["projected_ro"].to_numpy(dtype=np.float32)
+    coords = np.ascontiguousarray(np.column_stack([lats, lons]))
+
+    if _cluster_jit is not None:
+        # JIT-compiled kernel: the whole seed/grow loop runs without
+        # Python round-trips and already returns the label/centroid arrays.
+        return _cluster_jit(lats, lons, ros, float(max_ro))
 
-    while unassigned:
+    labels = np.full(n, -1, dtype=np.int32)
+    if n == 0:
+        # nothing to cluster; mirror the kernel's empty output instead of
+        # handing BallTree a zero-sample array
+        empty = np.empty(0, dtype=np.float64)
+        return labels, empty, empty.copy(), empty.copy()
+    centroid_lat_list = []
+    centroid_lon_list = []
+    total_list = []
+    cid = 0
+    mask = np.ones(n, dtype=bool)
+    n_left = n
+    # Spatial index over all points: nearest-unassigned lookups become
+    # O(log N) tree queries instead of a linear scan per step. The tree is
+    # pruned and rebuilt when too many of its entries are already assigned.
+    coords_rad = np.radians(coords, dtype=np.float32)
+    tree = BallTree(coords_rad, metric="haversine")
+    tree_idx = np.arange(n)
+
+    while n_left > 0:
         # pick seed = unassigned index with max projected_ro
-        seed = max(unassigned, key=lambda idx: working.at[idx,"projected_ro"])
+        seed = int(np.argmax(np.where(mask, ros, -np.inf)))
         cluster_members = [seed]
-        unassigned.remove(seed)
-        cluster_total = working.at[seed,"projected_ro"]
-        # compute centroid (weighted by RO)
-        centroid_lat = working.at[seed,"lat"]
-        centroid_lon = working.at[seed,"lon"]
-        while cluster_total < max_ro and unassigned:
-            # find nearest unassigned index to current centroid
-            nearest = min(unassigned, key=lambda idx: haversine_km(centroid_lat, centroid_lon, working.at[idx,"lat"], working.at[idx,"lon"]))
+        labels[seed] = cid
+        mask[seed] = False
+        n_left -= 1
+        cluster_total = ros[seed]
+        # weighted centroid maintained incrementally (O(1) per added point)
+        sum_w = ros[seed]
+        sum_lat_w = ros[seed] * lats[seed]
+        sum_lon_w = ros[seed] * lons[seed]
+        centroid_lat = lats[seed]
+        centroid_lon = lons[seed]
+        while cluster_total < max_ro and n_left > 0:
+            # find nearest unassigned index to the current centroid. On
+            # exact-distance ties (duplicate coordinates) tree.query returns
+            # candidates in arbitrary order, so take the lowest original
+            # index among the tied minimum — the same tie-break as the
+            # kernel's strict < scan.
+            nearest = -1
+            k = 32
+            while nearest < 0:
+                k = min(k, len(tree_idx))
+                d, cand = tree.query(np.radians([[centroid_lat, centroid_lon]]), k=k)
+                best_d = np.inf
+                for dist, j in zip(d[0], cand[0]):
+                    orig = int(tree_idx[j])
+                    if not mask[orig]:
+                        continue
+                    if dist > best_d:
+                        break
+                    if nearest < 0 or orig < nearest:
+                        best_d = dist
+                        nearest = orig
+                if nearest < 0:
+                    # all k candidates were assigned: rebuild on the remainder
+                    tree_idx = np.flatnonzero(mask)
+                    tree = BallTree(coords_rad[tree_idx], metric="haversine")
+                    k = 32
+                elif d[0][-1] <= best_d and k < len(tree_idx):
+                    # the tie group may extend past the k returned candidates;
+                    # widen the query so no lower tied index is missed
+                    nearest = -1
+                    k *= 2
             # add it
             cluster_members.append(nearest)
-            unassigned.remove(nearest)
-            cluster_total += working.at[nearest,"projected_ro"]
+            labels[nearest] = cid
+            mask[nearest] = False
+            n_left -= 1
+            cluster_total += ros[nearest]
             # update centroid weighted by projected_ro
-            weights = working.loc[cluster_members,"projected_ro"].values
-            lats = working.loc[cluster_members,"lat"].values
-            lons = working.loc[cluster_members,"lon"].values
-            if weights.sum() > 0:
-                centroid_lat = (lats * weights).sum() / weights.sum()
-                centroid_lon = (lons * weights).sum() / weights.sum()
+            sum_w += ros[nearest]
+            sum_lat_w += ros[nearest] * lats[nearest]
+            sum_lon_w += ros[nearest] * lons[nearest]
+            if sum_w > 0:
+                centroid_lat = sum_lat_w / sum_w
+                centroid_lon = sum_lon_w / sum_w
             else:
-                centroid_lat = lats.mean()
-                centroid_lon = lons.mean()
-        members_df = working.loc[cluster_members].copy().reset_index(drop=True)
-        clusters.append({
-            "members": members_df,
-            "total_ro": float(cluster_total),
-            "centroid": (float(centroid_lat), float(centroid_lon))
-        })
-    return clusters
+                centroid_lat = lats[cluster_members].mean()
+                centroid_lon = lons[cluster_members].mean()
+        centroid_lat_list.append(float(centroid_lat))
+        centroid_lon_list.append(float(centroid_lon))
+        total_list.append(float(cluster_total))
+        cid += 1
+    return (
+        labels,
+        np.asarray(centroid_lat_list, dtype=np.float64),
+        np.asarray(centroid_lon_list, dtype=np.float64),
+        np.asarray(total_list, dtype=np.float64),
+    )
 
 def find_centroid_pincode(members_df, centroid):
     """
@@ -72,10 +167,37 @@ def find_centroid_pincode(members_df, centroid):
     """
     if members_df.empty:
         return None, None, None
-    distances = members_df.apply(lambda r: haversine_km(centroid[0], centroid[1], r["lat"], r["lon"]), axis=1)
-    idx = distances.idxmin()
-    row = members_df.loc[idx]
-    return row.get("pincode"), float(row.get("lat")), float(row.get("lon"))
+    lats = members_df["lat"].to_numpy()
+    lons = members_df["lon"].to_numpy()
+    d = haversine_km_vec(centroid[0], centroid[1], lats, lons)
+    i = int(d.argmin())
+    return members_df["pincode"].iat[i], float(lats[i]), float(lons[i])
+
+def build_workshop_tree(lats, lons):
+    """
+    Build a BallTree (haversine metric) over workshop coordinates in degrees.
+    Build it once and reuse it for all proximity queries.
+    Returns None when there are no workshops.
+    """
+    coords = np.column_stack([
+        np.asarray(lats, dtype=np.float64),
+        np.asarray(lons, dtype=np.float64),
+    ])
+    if len(coords) == 0:
+        return None
+    return BallTree(np.radians(coords), metric="haversine")
+
+def nearest_workshop_km(lats, lons, tree):
+    """
+    Distance in km from each query point to its nearest workshop, computed
+    in a single vectorized BallTree query. Returns inf per point if tree is None.
+    """
+    qlats = np.atleast_1d(np.asarray(lats, dtype=np.float64))
+    qlons = np.atleast_1d(np.asarray(lons, dtype=np.float64))
+    if tree is None:
+        return np.full(len(qlats), np.inf)
+    d_rad, _ = tree.query(np.radians(np.column_stack([qlats, qlons])), k=1)
+    return d_rad[:, 0] * EARTH_RADIUS_KM
 
 def nearest_distance_to_workshops(lat, lon, workshops_df):
     """
@@ -84,5 +206,5 @@ def nearest_distance_to_workshops(lat, lon, workshops_df):
     """
     if workshops_df.empty:
         return float("inf")
-    dists = workshops_df.apply(lambda r: haversine_km(lat, lon, r["lat"], r["lon"]), axis=1)
+    dists = haversine_km_vec(lat, lon, workshops_df["lat"].values, workshops_df["lon"].values)
     return float(dists.min())
\ No newline at end of file
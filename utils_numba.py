@@ -0,0 +1,90 @@
+import math
+import numpy as np
+from numba import njit
+
+R_KM = 6371.0
+
+@njit(cache=True, fastmath=True)
+def _cluster(lats, lons, ros, max_ro):
+    """
+    JIT-compiled greedy spatial clustering kernel.
+    Inputs are float64 arrays (degrees / RO counts). Returns
+    (labels, centroid_lats, centroid_lons, totals) where labels[i] is the
+    cluster id of row i and the other arrays have one entry per cluster.
+    """
+    n = lats.shape[0]
+    labels = np.full(n, -1, dtype=np.int32)
+    centroid_lats = np.empty(n, dtype=np.float64)
+    centroid_lons = np.empty(n, dtype=np.float64)
+    totals = np.empty(n, dtype=np.float64)
+    rlats = np.radians(lats)
+    rlons = np.radians(lons)
+    assigned = np.zeros(n, dtype=np.uint8)
+    n_left = n
+    c = 0
+    while n_left > 0:
+        # seed = unassigned index with max projected RO (-inf start so the
+        # first unassigned row always wins, even with negative ROs)
+        seed = -1
+        best_ro = -np.inf
+        for i in range(n):
+            if assigned[i] == 0 and ros[i] > best_ro:
+                seed = i
+                best_ro = ros[i]
+        assigned[seed] = 1
+        n_left -= 1
+        labels[seed] = c
+        total = ros[seed]
+        # track the weighted centroid directly in the precomputed radian
+        # arrays; radians is linear, so the weighted mean is identical and
+        # no degree->radian conversion happens per growth step
+        sum_w = ros[seed]
+        sum_lat_w = ros[seed] * rlats[seed]
+        sum_lon_w = ros[seed] * rlons[seed]
+        # unweighted sums back the zero-weight fallback below
+        n_members = 1
+        sum_lat = rlats[seed]
+        sum_lon = rlons[seed]
+        rclat = rlats[seed]
+        rclon = rlons[seed]
+        while total < max_ro and n_left > 0:
+            cos_c = math.cos(rclat)
+            # nearest unassigned point to the current centroid. The argmin
+            # only needs ranks, so compare squared equirectangular distance
+            # ((dlon*cos(lat0))^2 + dlat^2): for the local neighborhoods
+            # grown here it orders like haversine (<0.1% error within
+            # ~100 km) with no sin/asin/sqrt per candidate.
+            best_d = np.inf
+            nearest = -1
+            for i in range(n):
+                if assigned[i] == 1:
+                    continue
+                dphi = rlats[i] - rclat
+                dlmb = rlons[i] - rclon
+                d2 = (dlmb * cos_c) ** 2 + dphi ** 2
+                if d2 < best_d:
+                    best_d = d2
+                    nearest = i
+            assigned[nearest] = 1
+            n_left -= 1
+            labels[nearest] = c
+            total += ros[nearest]
+            sum_w += ros[nearest]
+            sum_lat_w += ros[nearest] * rlats[nearest]
+            sum_lon_w += ros[nearest] * rlons[nearest]
+            n_members += 1
+            sum_lat += rlats[nearest]
+            sum_lon += rlons[nearest]
+            if sum_w > 0:
+                rclat = sum_lat_w / sum_w
+                rclon = sum_lon_w / sum_w
+            else:
+                # all-zero ROs: fall back to the unweighted member mean,
+                # matching the NumPy path
+                rclat = sum_lat / n_members
+                rclon = sum_lon / n_members
+        centroid_lats[c] = math.degrees(rclat)
+        centroid_lons[c] = math.degrees(rclon)
+        totals[c] = total
+        c += 1
+    return labels, centroid_lats[:c], centroid_lons[:c], totals[:c]